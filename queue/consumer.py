@@ -1,25 +1,52 @@
 #!/usr/bin/env python
+import cookielib
 import json
 import logging
 import multiprocessing
+import os
+import threading
 import time
-from datetime import datetime, timedelta
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
 from queue.models import Submission
-from queue.producer import get_queue_length
 
-import pytz
 import requests
 from django.conf import settings
+from django.db import close_old_connections, transaction
 from django.db.models import Q
 from django.utils import timezone
 from requests.exceptions import ConnectionError, Timeout
+from requests.packages.urllib3.util.retry import Retry
 
 log = logging.getLogger(__name__)
 
+# Per-process requests Sessions, see _get_session()
+_sessions = {}
+_sessions_pid = None
+
+
+
+class BackoffRetry(Retry):
+    '''
+    urllib3 retry policy that ignores a server's Retry-After header, so the time
+        spent between attempts stays bounded by the exponential backoff
+    '''
+    def get_retry_after(self, response):
+        return None
+
+
+# Retry policy for posts back to the LMS. We've seen abrupt disconnects when
+# LMS servers are taken out of the ELB, so connection errors and gateway errors
+# are retried with exponential backoff; any other status is final.
+LMS_RETRY = BackoffRetry(total=4, backoff_factor=0.3, status_forcelist=[502, 503, 504],
+                         method_whitelist=frozenset(['POST']), raise_on_status=False)
+
 
 def get_single_unretired_submission(queue_name):
     '''
-    Retrieve a single unretired queued item, if one exists, for the named queue
+    Retrieve a single unretired queued item, if one exists, for the named queue.
+        The item is claimed by stamping its pull_time in the same transaction,
+        so that concurrent pulls do not hand out the same submission.
 
     Returns (success, submission):
         success:    Flag whether retrieval is successful (Boolean)
@@ -28,8 +55,14 @@ def get_single_unretired_submission(queue_name):
     '''
 
     # Look for submissions that haven't been pulled or were pulled more than SUBMISSION_PROCESSING_DELAY ago
-    pull_time_filter = Q(pull_time__lte=(datetime.now(pytz.utc) - timedelta(minutes=settings.SUBMISSION_PROCESSING_DELAY))) | Q(pull_time__isnull=True)
-    submission = Submission.objects.filter(pull_time_filter, queue_name=queue_name, retired=False).order_by('arrival_time').first()
+    pull_time_filter = Q(pull_time__lte=(timezone.now() - timedelta(minutes=settings.SUBMISSION_PROCESSING_DELAY))) | Q(pull_time__isnull=True)
+    with transaction.atomic():
+        # Only load what the pull interface hands to the grader
+        submission = Submission.objects.select_for_update().filter(pull_time_filter, queue_name=queue_name, retired=False).only(
+            'xqueue_body', 's3_urls').order_by('arrival_time').first()
+        if submission:
+            submission.pull_time = timezone.now()
+            Submission.objects.filter(pk=submission.pk).update(pull_time=submission.pull_time)
 
     if submission:
         return (True, submission)
@@ -37,24 +70,36 @@ def get_single_unretired_submission(queue_name):
         return (False, '')
 
 
+# This is the only part of the XQueue that assumes knowledge of
+# the external grader message format.
+# TODO: Make the notification message-format agnostic
+FAILURE_MSG = json.dumps({
+    'correct': None,
+    'score': 0,
+    'msg': ('<div class="capa_alert">'
+            'Your submission could not be graded. '
+            'Please recheck your submission and try again. '
+            'If the problem persists, please notify the course staff.'
+            '</div>'),
+})
+
+
+def grader_payload(submission):
+    '''
+    Serialize the body posted to a push grader for a submission.
+        Separators are compact, as submission bodies can be large.
+    '''
+    payload = {'xqueue_body': submission.xqueue_body,
+               'xqueue_files': submission.urls}
+    return json.dumps(payload, separators=(',', ':'))
+
+
 def post_failure_to_lms(header):
     '''
     Send notification to the LMS (and the student) that the submission has failed,
         and that the problem should be resubmitted
     '''
-
-    # This is the only part of the XQueue that assumes knowledge of
-    # the external grader message format.
-    # TODO: Make the notification message-format agnostic
-    msg = '<div class="capa_alert">'
-    msg += 'Your submission could not be graded. '
-    msg += 'Please recheck your submission and try again. '
-    msg += 'If the problem persists, please notify the course staff.'
-    msg += '</div>'
-    failure_msg = {'correct': None,
-                   'score': 0,
-                   'msg': msg}
-    return post_grade_to_lms(header, json.dumps(failure_msg))
+    return post_grade_to_lms(header, FAILURE_MSG)
 
 
 def post_grade_to_lms(header, body):
@@ -71,17 +116,10 @@ def post_grade_to_lms(header, body):
 
     payload = {'xqueue_header': header, 'xqueue_body': body}
 
-    # Quick kludge retries to fix prod problem with 6.00x push graders. We're
-    # seeing abrupt disconnects when servers are taken out of the ELB, causing
-    # in flight lms_ack requests to fail. This just tries five times before
-    # giving up.
-    attempts = 0
-    success = False
-    while (not success) and attempts < 5:
-        (success, lms_reply) = _http_post(lms_callback_url,
-                                          payload,
-                                          settings.REQUESTS_TIMEOUT)
-        attempts += 1
+    (success, lms_reply) = _http_post(lms_callback_url,
+                                      payload,
+                                      settings.REQUESTS_TIMEOUT,
+                                      max_retries=LMS_RETRY)
 
     if not success:
         log.error("Unable to return to LMS: lms_callback_url: {0}, payload: {1}, lms_reply: {2}".format(lms_callback_url, payload, lms_reply))
@@ -89,21 +127,56 @@ def post_grade_to_lms(header, body):
     return success
 
 
-def _http_post(url, data, timeout):
+def _get_session(max_retries=0):
+    '''
+    Return the requests Session used for outgoing HTTP posts with the given
+        urllib3 retry policy, so that connections to graders and the LMS are kept
+        alive and reused between posts. Basic auth is configured on the Session
+        once, from settings.
+        Each process gets its own Sessions, since pooled sockets must not be shared
+        with a forked Worker.
+
+        Reused connections carry a small, accepted risk for grader posts, which are
+        never retried: urllib3 checks a pooled socket before reusing it, but if the
+        grader closes an idle connection at that very moment the post fails and the
+        submission is retired as failed, just as for any other connection error.
+        Retrying it could grade a submission twice, since the post may have arrived.
+    '''
+    global _sessions, _sessions_pid
+
+    if _sessions_pid != os.getpid():
+        _sessions = {}
+        _sessions_pid = os.getpid()
+
+    if max_retries not in _sessions:
+        session = requests.Session()
+        # Like requests.post, never send back cookies from earlier replies, e.g. a
+        # sticky load balancer cookie that would pin every post to one backend
+        session.cookies.set_policy(cookielib.DefaultCookiePolicy(allowed_domains=[]))
+        if settings.REQUESTS_BASIC_AUTH is not None:
+            session.auth = requests.auth.HTTPBasicAuth(*settings.REQUESTS_BASIC_AUTH)
+        # Leave room in the pool for a Worker's concurrent deliveries
+        pool_maxsize = max(settings.CONSUMER_BATCH_SIZE, requests.adapters.DEFAULT_POOLSIZE)
+        for prefix in ('http://', 'https://'):
+            session.mount(prefix, requests.adapters.HTTPAdapter(pool_maxsize=pool_maxsize,
+                                                                max_retries=max_retries))
+        _sessions[max_retries] = session
+    return _sessions[max_retries]
+
+
+def _http_post(url, data, timeout, max_retries=0):
     '''
     Contact external grader server, but fail gently.
+        max_retries: urllib3 retry policy (or count) for the post
 
     Returns (success, msg), where:
         success: Flag indicating successful exchange (Boolean)
         msg: Accompanying message; Grader reply when successful (string)
     '''
-    if settings.REQUESTS_BASIC_AUTH is not None:
-        auth = requests.auth.HTTPBasicAuth(*settings.REQUESTS_BASIC_AUTH)
-    else:
-        auth = None
-
     try:
-        r = requests.post(url, data=data, auth=auth, timeout=timeout, verify=False)
+        # verify is passed per call: a Session-level value would be overridden by
+        # REQUESTS_CA_BUNDLE/CURL_CA_BUNDLE from the environment
+        r = _get_session(max_retries).post(url, data=data, timeout=timeout, verify=settings.REQUESTS_VERIFY)
     except (ConnectionError, Timeout):
         log.error('Could not connect to server at %s in timeout=%f' % (url, timeout))
         return (False, 'cannot connect to server')
@@ -124,52 +197,119 @@ class Worker(multiprocessing.Process):
         self.queue_name = queue_name
         self.worker_url = worker_url
 
+        # Built once and narrowed by push_time on every claim. Only load what
+        # _deliver_submission reads.
+        self.processing_delay = timedelta(minutes=settings.SUBMISSION_PROCESSING_DELAY)
+        self.unretired_submissions = Submission.objects.filter(queue_name=queue_name, retired=False).only(
+            'xqueue_header', 'xqueue_body', 's3_urls', 'num_failures').order_by('arrival_time')
+
+        # Ids of the submissions this worker is delivering. A delivery can outlast
+        # SUBMISSION_PROCESSING_DELAY, so these are never claimed a second time.
+        self.in_flight = set()
+        self.in_flight_lock = threading.Lock()
+
     def run(self):
         log.info("Starting consumer for queue {queue}".format(queue=self.queue_name))
 
+        # Deliveries spend their time waiting on the grader and the LMS, so up to
+        # CONSUMER_BATCH_SIZE of them are kept in flight from a pool of threads.
+        # A slot is refilled as soon as its delivery finishes, so one slow grader
+        # reply does not hold up the submissions behind it.
+        pool = ThreadPool(settings.CONSUMER_BATCH_SIZE)
+        slots = threading.BoundedSemaphore(settings.CONSUMER_BATCH_SIZE)
+
         while True:
-            # Look for submissions that haven't been pushed or were pushed more than 1 minute ago
-            push_time_filter = Q(push_time__lte=(datetime.now(pytz.utc) - timedelta(minutes=settings.SUBMISSION_PROCESSING_DELAY))) | Q(push_time__isnull=True)
-            submission = Submission.objects.filter(push_time_filter, queue_name=self.queue_name, retired=False).order_by('arrival_time').first()
-            if submission:
-                self._deliver_submission(submission)
-            # Wait the given seconds between checking the database
-            time.sleep(settings.CONSUMER_DELAY)
+            # Wait for a free slot, then take any others that are also free
+            slots.acquire()
+            free_slots = 1
+            while free_slots < settings.CONSUMER_BATCH_SIZE and slots.acquire(False):
+                free_slots += 1
+
+            submissions = self._claim_submissions(free_slots)
+            for _ in range(free_slots - len(submissions)):
+                slots.release()
+
+            for submission in submissions:
+                pool.apply_async(self._deliver_in_slot, (submission, slots))
+
+            if not submissions:
+                # Wait the given seconds between checking an empty queue
+                time.sleep(settings.CONSUMER_DELAY)
 
         log.info("Consumer for queue {queue} stopped".format(queue=self.queue_name))
 
-    def _deliver_submission(self, submission):
-        payload = {'xqueue_body': submission.xqueue_body,
-                   'xqueue_files': submission.urls}
+    def _claim_submissions(self, count):
+        '''
+        Retrieve up to count of the oldest submissions due for delivery on this worker's
+            queue, stamping their push_time in the same transaction so that no other
+            worker on the queue delivers them as well
+        '''
+        # Look for submissions that haven't been pushed or were pushed more than SUBMISSION_PROCESSING_DELAY ago
+        push_time_filter = Q(push_time__lte=(timezone.now() - self.processing_delay)) | Q(push_time__isnull=True)
+        with transaction.atomic():
+            deliverable = self.unretired_submissions.select_for_update().filter(push_time_filter)
+            with self.in_flight_lock:
+                if self.in_flight:
+                    deliverable = deliverable.exclude(pk__in=list(self.in_flight))
+            submissions = list(deliverable[:count])
+            if submissions:
+                push_time = timezone.now()
+                for submission in submissions:
+                    submission.grader_id = self.worker_url
+                    submission.push_time = push_time
+                claimed = Submission.objects.filter(pk__in=[submission.pk for submission in submissions])
+                claimed.update(grader_id=self.worker_url, push_time=push_time)
+                with self.in_flight_lock:
+                    self.in_flight.update(submission.pk for submission in submissions)
+        return submissions
+
+    def _deliver_in_slot(self, submission, slots):
+        '''
+        Deliver a claimed submission from a pool thread, then free its delivery slot.
+            A failed delivery is retried once SUBMISSION_PROCESSING_DELAY has passed.
+        '''
+        try:
+            self._deliver_submission(submission)
+        except Exception:
+            log.exception("Delivery of submission {} to grader {} failed".format(submission.id, self.worker_url))
+            # Drop this thread's database connection if the error left it unusable
+            close_old_connections()
+        finally:
+            with self.in_flight_lock:
+                self.in_flight.discard(submission.pk)
+            slots.release()
 
-        submission.grader_id = self.worker_url
-        submission.push_time = timezone.now()
+    def _deliver_submission(self, submission):
         start = time.time()
-        (grading_success, grader_reply) = _http_post(self.worker_url, json.dumps(payload), settings.GRADING_TIMEOUT)
+        (grading_success, grader_reply) = _http_post(self.worker_url, grader_payload(submission), settings.GRADING_TIMEOUT)
         grading_time = time.time() - start
 
         if grading_time > settings.GRADING_TIMEOUT:
             log.error("Grading time above {} for submission. grading_time: {}s body: {} files: {}".format(settings.GRADING_TIMEOUT,
                       grading_time, submission.xqueue_body, submission.urls))
 
-        job_count = get_queue_length(self.queue_name)
-
         submission.return_time = timezone.now()
 
+        # grader_id and push_time were already written when the submission was claimed,
+        # so only the columns set here are written back
+        update_fields = ['return_time', 'lms_ack', 'retired']
+
         # TODO: For the time being, a submission in a push interface gets one chance at grading,
         #       with no requeuing logic
         if grading_success:
             submission.grader_reply = grader_reply
             submission.lms_ack = post_grade_to_lms(submission.xqueue_header, grader_reply)
+            update_fields.append('grader_reply')
         else:
             log.error("Submission {} to grader {} failure: Reply: {}, ".format(submission.id, self.worker_url, grader_reply))
             submission.num_failures += 1
             submission.lms_ack = post_failure_to_lms(submission.xqueue_header)
+            update_fields.append('num_failures')
 
         # NOTE: retiring pushed submissions after one shot regardless of grading_success
         submission.retired = True
 
-        submission.save()
+        submission.save(update_fields=update_fields)
 
     def __repr__(self):
         return "Worker (%r, %r)" % (self.worker_url, self.queue_name)
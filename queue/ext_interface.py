@@ -41,10 +41,14 @@ def get_queuelen(request):
         return HttpResponse(compose_reply(False, 'Valid queue names are: ' + ', '.join(settings.XQUEUES.keys())))
 
 
+@transaction.non_atomic_requests
 @login_required
 def get_submission(request):
     '''
     Retrieve a single submission from queue named by GET['queue_name'].
+
+    Not wrapped in a request transaction, so the claim's row locks are released as
+    soon as the claim commits rather than once the external file dict is fetched.
     '''
     try:
         queue_name = request.GET['queue_name']
@@ -62,15 +66,15 @@ def get_submission(request):
         else:
             # Collect info on pull event
             grader_id = get_request_ip(request)
-            pull_time = timezone.now()
+            pull_time = submission.pull_time
 
             pullkey = make_hashkey(str(pull_time)+str(submission.id))
 
+            # pull_time was already written when the submission was claimed
             submission.grader_id = grader_id
-            submission.pull_time = pull_time
             submission.pullkey = pullkey
 
-            submission.save()
+            submission.save(update_fields=['grader_id', 'pullkey'])
 
             # Prepare payload to external grader
             ext_header = {'submission_id': submission.id, 'submission_key': pullkey}
@@ -78,6 +78,8 @@ def submit(request):
                 submission.save()
                 transaction.commit()  # Explicit commit to DB before inserting submission.id into queue
 
+                # The returned queue position must count this submission
+                queue.producer.clear_queue_length(queue_name)
                 qcount = queue.producer.get_queue_length(queue_name)
 
                 # For a successful submission, return the count of prior items
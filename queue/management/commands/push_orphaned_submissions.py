@@ -1,8 +1,8 @@
-import json
 import logging
 from queue.consumer import \
     _http_post  # TODO: Wrap the _http_post which is used to deliver to grader
-from queue.consumer import post_failure_to_lms, post_grade_to_lms
+from queue.consumer import (grader_payload, post_failure_to_lms,
+                            post_grade_to_lms)
 from queue.models import Submission
 
 from django.conf import settings
@@ -35,12 +35,9 @@ class Command(BaseCommand):
                     orphaned_submission.queue_name, orphaned_submission.xqueue_header))
                 orphaned_submission.num_failures += 1
 
-                payload = {'xqueue_body': orphaned_submission.xqueue_body,
-                           'xqueue_files': orphaned_submission.urls}
-
                 orphaned_submission.grader_id = settings.XQUEUES[orphaned_submission.queue_name]
                 orphaned_submission.push_time = timezone.now()
-                (grading_success, grader_reply) = _http_post(orphaned_submission.grader_id, json.dumps(payload), settings.GRADING_TIMEOUT)
+                (grading_success, grader_reply) = _http_post(orphaned_submission.grader_id, grader_payload(orphaned_submission), settings.GRADING_TIMEOUT)
                 orphaned_submission.return_time = timezone.now()
 
                 if grading_success:
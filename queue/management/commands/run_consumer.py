@@ -4,6 +4,7 @@ from queue.consumer import Worker
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import connections
 
 log = logging.getLogger(__name__)
 
@@ -21,6 +22,8 @@ class Command(BaseCommand):
         log.info(' [*] Starting queue workers...')
 
         workers = []
+        # Workers are forked after Django setup has loaded the settings, including
+        # the env and auth JSON files, so they inherit them without re-reading.
         queues = settings.XQUEUES.items()
 
         # Assigned one worker for queue
@@ -31,8 +34,7 @@ class Command(BaseCommand):
 
         # Start workers
         for worker in workers:
-            log.info(' [{}] Starting worker'.format(worker.queue_name))
-            worker.start()
+            self.start_worker(worker)
 
         # Monitor workers
         while workers:
@@ -68,5 +70,14 @@ class Command(BaseCommand):
             new_worker = Worker(queue_name=worker.queue_name, worker_url=worker.worker_url)
             workers.append(new_worker)
 
-            log.info(' [{}] Starting worker'.format(new_worker.id))
-            new_worker.start()
+            self.start_worker(new_worker)
+
+    def start_worker(self, worker):
+        # Workers are always forked, as Python 2 multiprocessing has no spawn or
+        # forkserver start methods. Close this process' database connections first,
+        # so the worker opens its own instead of sharing the inherited sockets with us
+        for connection in connections.all():
+            connection.close()
+
+        log.info(' [{}] Starting worker'.format(worker.queue_name))
+        worker.start()
@@ -0,0 +1,23 @@
+"""
+Tests of the run_consumer management command.
+"""
+from __future__ import absolute_import
+
+from queue.management.commands.run_consumer import Command
+
+import mock
+from django.test import TestCase
+
+
+class TestRunConsumer(TestCase):
+    """
+    Tests of the run_consumer management command.
+    """
+    def test_start_worker_closes_connections(self):
+        worker = mock.Mock(queue_name=u'tmp')
+        connection = mock.Mock()
+        with mock.patch('queue.management.commands.run_consumer.connections') as mock_connections:
+            mock_connections.all.return_value = [connection]
+            Command().start_worker(worker)
+        assert connection.close.call_count == 1
+        assert worker.start.call_count == 1
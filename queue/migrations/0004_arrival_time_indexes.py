@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue', '0003_compound_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='submission',
+            index_together=set([('queue_name', 'retired', 'pull_time', 'arrival_time'), ('queue_name', 'retired', 'arrival_time', 'pull_time'), ('lms_callback_url', 'retired'), ('queue_name', 'retired', 'push_time', 'arrival_time'), ('queue_name', 'retired', 'arrival_time', 'push_time')]),
+        ),
+    ]
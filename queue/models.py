@@ -20,8 +20,13 @@ class Submission(models.Model):
     class Meta(object):
         # Once we get to Django 1.11 use indexes, it would have allowed a better index name
         # https://docs.djangoproject.com/en/1.11/ref/models/options/#django.db.models.Options.indexes
+        # The arrival_time-first indexes serve the oldest-first claims of push workers
+        # and pull graders: rows are read in arrival order and the push_time/pull_time
+        # condition is checked from the index, so a claim stops at the first match.
         index_together = [('queue_name', 'retired', 'push_time', 'arrival_time'),
                           ('queue_name', 'retired', 'pull_time', 'arrival_time'),
+                          ('queue_name', 'retired', 'arrival_time', 'push_time'),
+                          ('queue_name', 'retired', 'arrival_time', 'pull_time'),
                           ('lms_callback_url', 'retired')]
 
     # Submission
@@ -1,14 +1,34 @@
-from datetime import datetime, timedelta
+from datetime import timedelta
 from queue.models import Submission
 
-import pytz
 from django.conf import settings
+from django.core.cache import cache
 from django.db.models import Q
+from django.utils import timezone
+
+
+def _queue_length_cache_key(queue_name):
+    return 'xqueue.queue_length.{}'.format(queue_name)
+
+
+def clear_queue_length(queue_name):
+    """
+    Drop the cached length of a queue, e.g. after a submission was added to it
+    """
+    cache.delete(_queue_length_cache_key(queue_name))
 
 
 def get_queue_length(queue_name):
     """
     How many unretired submissions are available for a queue
+
+    The count is cached for QUEUE_LENGTH_CACHE_TIMEOUT seconds, since it is
+    asked for on every LMS submission and every pull grader poll
     """
-    pull_time_filter = Q(pull_time__lte=(datetime.now(pytz.utc) - timedelta(minutes=settings.SUBMISSION_PROCESSING_DELAY))) | Q(pull_time__isnull=True)
-    return Submission.objects.filter(pull_time_filter, queue_name=queue_name, retired=False).count()
+    cache_key = _queue_length_cache_key(queue_name)
+    queue_length = cache.get(cache_key)
+    if queue_length is None:
+        pull_time_filter = Q(pull_time__lte=(timezone.now() - timedelta(minutes=settings.SUBMISSION_PROCESSING_DELAY))) | Q(pull_time__isnull=True)
+        queue_length = Submission.objects.filter(pull_time_filter, queue_name=queue_name, retired=False).count()
+        cache.set(cache_key, queue_length, settings.QUEUE_LENGTH_CACHE_TIMEOUT)
+    return queue_length
@@ -0,0 +1,302 @@
+"""
+Tests of the ``queue.consumer`` module.
+"""
+from __future__ import absolute_import
+
+import json
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from datetime import timedelta
+from queue import consumer
+from queue.consumer import Worker, get_single_unretired_submission
+from queue.models import Submission
+
+import mock
+import requests
+from django.test import TestCase, override_settings
+
+
+def create_submission(queue_name, **kwargs):
+    """
+    Create a Submission on the named queue.
+    """
+    xqueue_header = json.dumps({'lms_callback_url': 'http://lms.example.com/callback',
+                                'lms_key': 'qwerty',
+                                'queue_name': queue_name})
+    return Submission.objects.create(queue_name=queue_name,
+                                     xqueue_header=xqueue_header,
+                                     xqueue_body='def square(x):\n    return x**2',
+                                     **kwargs)
+
+
+class TestGetSingleUnretiredSubmission(TestCase):
+    """
+    Tests of ``get_single_unretired_submission``.
+    """
+    def test_empty_queue(self):
+        assert get_single_unretired_submission('empty') == (False, '')
+
+    def test_claims_submission(self):
+        submission = create_submission('tmp')
+
+        got_submission, pulled = get_single_unretired_submission('tmp')
+        assert got_submission
+        assert pulled.id == submission.id
+        assert pulled.pull_time is not None
+        assert Submission.objects.get(id=submission.id).pull_time == pulled.pull_time
+        assert 'grader_reply' in pulled.get_deferred_fields()
+
+        # A claimed submission is not handed out again
+        assert get_single_unretired_submission('tmp') == (False, '')
+
+
+class TestWorker(TestCase):
+    """
+    Tests of the ``Worker`` push consumer.
+    """
+    def setUp(self):
+        self.worker = Worker(queue_name='tmp', worker_url='http://grader.example.com')
+
+    def test_claim_empty_queue(self):
+        assert self.worker._claim_submissions(4) == []
+
+    def test_claim_submissions(self):
+        first = create_submission('tmp')
+        second = create_submission('tmp')
+        third = create_submission('tmp')
+        create_submission('other')
+
+        claimed = self.worker._claim_submissions(2)
+        assert [submission.id for submission in claimed] == [first.id, second.id]
+        for submission in claimed:
+            assert submission.grader_id == self.worker.worker_url
+            assert 'grader_reply' in submission.get_deferred_fields()
+            stored = Submission.objects.get(id=submission.id)
+            assert stored.push_time == submission.push_time
+            assert stored.grader_id == self.worker.worker_url
+
+        assert [submission.id for submission in self.worker._claim_submissions(2)] == [third.id]
+        assert self.worker._claim_submissions(2) == []
+
+    def test_retired_submissions_are_not_claimed(self):
+        create_submission('tmp', retired=True)
+        assert self.worker._claim_submissions(4) == []
+
+    def test_in_flight_submissions_are_not_claimed_again(self):
+        submission = create_submission('tmp')
+        claimed, = self.worker._claim_submissions(1)
+
+        # Still being delivered after SUBMISSION_PROCESSING_DELAY has passed
+        stale = claimed.push_time - self.worker.processing_delay - timedelta(seconds=1)
+        Submission.objects.filter(id=submission.id).update(push_time=stale)
+        assert self.worker._claim_submissions(1) == []
+
+        with mock.patch.object(Worker, '_deliver_submission'):
+            self.worker._deliver_in_slot(claimed, mock.Mock())
+        assert [resend.id for resend in self.worker._claim_submissions(1)] == [submission.id]
+
+    def test_deliver_submission(self):
+        submission = create_submission('tmp')
+        claimed, = self.worker._claim_submissions(1)
+        with mock.patch('queue.consumer._http_post', return_value=(True, 'graded')), \
+                mock.patch('queue.consumer.post_grade_to_lms', return_value=True) as mock_post_grade, \
+                self.assertNumQueries(1):
+            self.worker._deliver_submission(claimed)
+        mock_post_grade.assert_called_once_with(submission.xqueue_header, 'graded')
+
+        stored = Submission.objects.get(id=submission.id)
+        assert stored.retired
+        assert stored.lms_ack
+        assert stored.grader_reply == 'graded'
+        assert stored.return_time is not None
+        assert stored.grader_id == self.worker.worker_url
+        assert stored.xqueue_body == submission.xqueue_body
+
+    def test_deliver_submission_failure(self):
+        submission = create_submission('tmp')
+        claimed, = self.worker._claim_submissions(1)
+        with mock.patch('queue.consumer._http_post', return_value=(False, 'cannot connect to server')), \
+                mock.patch('queue.consumer.post_failure_to_lms', return_value=True):
+            self.worker._deliver_submission(claimed)
+
+        stored = Submission.objects.get(id=submission.id)
+        assert stored.retired
+        assert stored.num_failures == 1
+        assert stored.grader_reply == ''
+
+    def test_deliver_in_slot_releases_slot(self):
+        submission = create_submission('tmp')
+        slots = mock.Mock()
+        with mock.patch.object(Worker, '_deliver_submission', side_effect=ValueError) as mock_deliver, \
+                mock.patch('queue.consumer.close_old_connections') as mock_close:
+            self.worker._deliver_in_slot(submission, slots)
+        mock_deliver.assert_called_once_with(submission)
+        assert mock_close.call_count == 1
+        assert slots.release.call_count == 1
+
+    def test_deliver_in_slot_keeps_connection(self):
+        submission = create_submission('tmp')
+        with mock.patch.object(Worker, '_deliver_submission'), \
+                mock.patch('queue.consumer.close_old_connections') as mock_close:
+            self.worker._deliver_in_slot(submission, mock.Mock())
+        assert mock_close.call_count == 0
+
+
+class TestGetSession(TestCase):
+    """
+    Tests of the per-process ``requests`` Session.
+    """
+    def test_session_is_reused(self):
+        assert consumer._get_session() is consumer._get_session()
+
+    def test_new_session_after_fork(self):
+        session = consumer._get_session()
+        with mock.patch('queue.consumer.os.getpid', return_value=consumer._sessions_pid + 1):
+            assert consumer._get_session() is not session
+
+    def test_session_per_retry_policy(self):
+        session = consumer._get_session(consumer.LMS_RETRY)
+        assert session is consumer._get_session(consumer.LMS_RETRY)
+        assert session is not consumer._get_session()
+        assert session.get_adapter('https://lms.example.com').max_retries is consumer.LMS_RETRY
+
+    @override_settings(REQUESTS_BASIC_AUTH=('xqueue', 'secret'))
+    def test_session_configuration(self):
+        with mock.patch('queue.consumer._sessions', {}):
+            session = consumer._get_session()
+        assert session.auth.username == 'xqueue'
+        assert session.auth.password == 'secret'
+
+
+def ok_response(request, **kwargs):
+    """
+    Stand-in for ``HTTPAdapter.send`` returning a successful reply.
+    """
+    response = requests.Response()
+    response.status_code = 200
+    response._content = b'graded'
+    response.request = request
+    return response
+
+
+class TestHTTPPost(TestCase):
+    """
+    Tests of ``_http_post``.
+    """
+    @override_settings(REQUESTS_VERIFY=False)
+    def test_verify_ignores_ca_bundle_environment(self):
+        with mock.patch.dict('os.environ', {'REQUESTS_CA_BUNDLE': '/etc/ssl/certs/ca.pem'}), \
+                mock.patch('requests.adapters.HTTPAdapter.send', side_effect=ok_response) as mock_send:
+            assert consumer._http_post('https://grader.example.com', 'payload', 30) == (True, 'graded')
+        assert mock_send.call_args[1]['verify'] is False
+
+
+class RetryAfterHandler(BaseHTTPRequestHandler):
+    """
+    Replies 503 to every post, asking the client to wait 100 seconds.
+    """
+    def do_POST(self):
+        self.rfile.read(int(self.headers.getheader('content-length')))
+        self.server.post_count += 1
+        self.send_response(503)
+        self.send_header('Retry-After', '100')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class SetCookieHandler(BaseHTTPRequestHandler):
+    """
+    Replies 200 to every post with a load balancer cookie, recording the Cookie
+    header each post arrived with.
+    """
+    def do_POST(self):
+        self.rfile.read(int(self.headers.getheader('content-length')))
+        self.server.cookies.append(self.headers.getheader('cookie'))
+        self.send_response(200)
+        self.send_header('Set-Cookie', 'AWSELB=backend-1; Path=/')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSessionCookies(TestCase):
+    """
+    Tests that the shared Sessions do not keep cookies between posts.
+    """
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), SetCookieHandler)
+        self.server.cookies = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_cookies_are_not_sent_back(self):
+        url = 'http://127.0.0.1:%d/' % self.server.server_port
+        assert consumer._http_post(url, 'payload', 5) == (True, '')
+        assert consumer._http_post(url, 'payload', 5) == (True, '')
+        assert self.server.cookies == [None, None]
+        assert len(consumer._get_session().cookies) == 0
+
+
+class TestLMSRetry(TestCase):
+    """
+    Tests of the ``LMS_RETRY`` policy.
+    """
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), RetryAfterHandler)
+        self.server.post_count = 0
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_retry_after_is_ignored(self):
+        url = 'http://127.0.0.1:%d/' % self.server.server_port
+        start = time.time()
+        assert consumer._http_post(url, {'xqueue_body': ''}, 5, max_retries=consumer.LMS_RETRY) == \
+            (False, 'unexpected HTTP status code [503]')
+        # Four retries back off 0 + 0.6 + 1.2 + 2.4 seconds, rather than 4 x 100
+        assert time.time() - start < 10
+        assert self.server.post_count == 5
+
+
+class TestGraderPayload(TestCase):
+    """
+    Tests of ``grader_payload``.
+    """
+    def test_grader_payload(self):
+        submission = Submission(xqueue_body='square', s3_urls='{}')
+        payload = consumer.grader_payload(submission)
+        assert json.loads(payload) == {'xqueue_body': 'square', 'xqueue_files': '{}'}
+        assert ' ' not in payload
+
+
+class TestPostFailureToLMS(TestCase):
+    """
+    Tests of ``post_failure_to_lms``.
+    """
+    def test_posts_failure_message(self):
+        header = json.dumps({'lms_callback_url': 'http://lms.example.com/callback'})
+        with mock.patch('queue.consumer._http_post', return_value=(True, '')) as mock_post:
+            assert consumer.post_failure_to_lms(header)
+
+        url, payload, _ = mock_post.call_args[0]
+        assert url == 'http://lms.example.com/callback'
+        assert mock_post.call_args[1] == {'max_retries': consumer.LMS_RETRY}
+        assert payload['xqueue_header'] == header
+        assert json.loads(payload['xqueue_body']) == {
+            'correct': None,
+            'score': 0,
+            'msg': ('<div class="capa_alert">Your submission could not be graded. '
+                    'Please recheck your submission and try again. '
+                    'If the problem persists, please notify the course staff.</div>'),
+        }
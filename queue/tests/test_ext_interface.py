@@ -0,0 +1,43 @@
+"""
+Tests of the external grader pull interface.
+"""
+from __future__ import absolute_import
+
+import json
+from queue import ext_interface
+from queue.models import Submission
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase, override_settings
+from django.test.client import Client
+
+
+@override_settings(XQUEUES={'tmp': None})
+class TestGetSubmission(TransactionTestCase):
+    """
+    Tests of the ``get_submission`` view.
+    """
+    def setUp(self):
+        credentials = {'username': 'grader', 'password': 'CambridgeMA'}
+        User.objects.create_user(**credentials)
+        self.client = Client()
+        self.client.login(**credentials)
+
+    def test_not_atomic(self):
+        # The claim must commit, releasing its row locks, before the view returns
+        assert ext_interface.get_submission._non_atomic_requests
+
+    def test_get_submission(self):
+        submission = Submission.objects.create(queue_name='tmp', xqueue_header='{}', xqueue_body='square')
+
+        response = self.client.get('/xqueue/get_submission/', {'queue_name': 'tmp'})
+        reply = json.loads(response.content)
+        assert reply['return_code'] == 0
+        content = json.loads(reply['content'])
+        assert content['xqueue_body'] == 'square'
+
+        stored = Submission.objects.get(id=submission.id)
+        assert stored.pull_time is not None
+        assert stored.grader_id == '127.0.0.1'
+        assert json.loads(content['xqueue_header']) == {'submission_id': submission.id,
+                                                        'submission_key': stored.pullkey}
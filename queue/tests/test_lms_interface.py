@@ -102,6 +102,19 @@ class TestLMSInterface(TransactionTestCase):
         self.assertEqual(response['return_code'], 0)  # success
         self.assertEqual(Submission.objects.count(), 1)
 
+    def test_submit_returns_current_queue_length(self):
+        '''
+        The queue length returned by submit should include the new submission,
+        even when an earlier length is cached.
+        '''
+        self.assertEqual(self._submit(self.valid_payload)['content'], '1')
+
+        payload = self.valid_payload.copy()
+        payload['xqueue_header'] = json.dumps({'lms_callback_url': '/other/',
+                                               'lms_key': 'qwerty',
+                                               'queue_name': 'tmp'})
+        self.assertEqual(self._submit(payload)['content'], '2')
+
     @override_settings(XQUEUES=[])
     def test_submit_unknown_queue(self):
         '''
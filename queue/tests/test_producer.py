@@ -0,0 +1,35 @@
+"""
+Tests of the ``queue.producer`` module.
+"""
+from __future__ import absolute_import
+
+from queue.models import Submission
+from queue.producer import clear_queue_length, get_queue_length
+
+from django.core.cache import cache
+from django.test import TestCase
+
+
+class TestGetQueueLength(TestCase):
+    """
+    Tests of ``get_queue_length``.
+    """
+    def setUp(self):
+        cache.clear()
+
+    def test_counts_unretired_submissions(self):
+        Submission.objects.create(queue_name='tmp')
+        Submission.objects.create(queue_name='tmp', retired=True)
+        Submission.objects.create(queue_name='other')
+        assert get_queue_length('tmp') == 1
+
+    def test_count_is_cached(self):
+        Submission.objects.create(queue_name='tmp')
+        assert get_queue_length('tmp') == 1
+
+        Submission.objects.create(queue_name='tmp')
+        with self.assertNumQueries(0):
+            assert get_queue_length('tmp') == 1
+
+        clear_queue_length('tmp')
+        assert get_queue_length('tmp') == 2
@@ -33,6 +33,8 @@ with open(ENV_ROOT / "xqueue.auth.json") as auth_file:
 
 SUBMISSION_PROCESSING_DELAY = ENV_TOKENS.get('SUBMISSION_PROCESSING_DELAY', SUBMISSION_PROCESSING_DELAY)
 CONSUMER_DELAY = ENV_TOKENS.get('CONSUMER_DELAY', CONSUMER_DELAY)
+CONSUMER_BATCH_SIZE = ENV_TOKENS.get('CONSUMER_BATCH_SIZE', CONSUMER_BATCH_SIZE)
+QUEUE_LENGTH_CACHE_TIMEOUT = ENV_TOKENS.get('QUEUE_LENGTH_CACHE_TIMEOUT', QUEUE_LENGTH_CACHE_TIMEOUT)
 
 DATABASES = AUTH_TOKENS['DATABASES']
 # The normal database user does not have enough permissions to run migrations.
@@ -51,6 +53,7 @@ AWS_ACCESS_KEY_ID = AUTH_TOKENS["AWS_ACCESS_KEY_ID"]
 AWS_SECRET_ACCESS_KEY = AUTH_TOKENS["AWS_SECRET_ACCESS_KEY"]
 
 REQUESTS_BASIC_AUTH = AUTH_TOKENS["REQUESTS_BASIC_AUTH"]
+REQUESTS_VERIFY = ENV_TOKENS.get('REQUESTS_VERIFY', REQUESTS_VERIFY)
 XQUEUE_USERS = AUTH_TOKENS.get('USERS', None)
 
 # Use S3 as the default storage backend
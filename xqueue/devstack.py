@@ -27,6 +27,7 @@ with open(ENV_ROOT / "xqueue.auth.json") as auth_file:
 DATABASES = AUTH_TOKENS['DATABASES']
 
 REQUESTS_BASIC_AUTH = AUTH_TOKENS["REQUESTS_BASIC_AUTH"]
+REQUESTS_VERIFY = ENV_TOKENS.get('REQUESTS_VERIFY', REQUESTS_VERIFY)
 XQUEUE_USERS = AUTH_TOKENS.get('USERS', None)
 
 # This is all used for file uploads, but some of these uploads are done by the LMS and are
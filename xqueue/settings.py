@@ -53,6 +53,10 @@ UPLOAD_URL_EXPIRE = 60 * 60 * 24 * 365  # 1 year
 # Basic auth tuple to pass to reqests library to authenticate with other services
 REQUESTS_BASIC_AUTH = None
 
+# TLS certificate verification for requests to graders and the LMS, passed to the
+# requests library as `verify`: True, False or the path to a CA bundle
+REQUESTS_VERIFY = False
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -177,6 +181,14 @@ RETRY_TIMEOUT = os.environ.get('RETRY_TIMEOUT', 10)
 # and be processing it.
 SUBMISSION_PROCESSING_DELAY = 1
 
-# Number of seconds to wait between checks for new submissions that need to be
+# Number of seconds to wait between checks of an empty queue for new submissions that need to be
 # sent to an external grader
 CONSUMER_DELAY = 10
+
+# Maximum number of submissions a push worker has in flight to its external
+# grader at once
+CONSUMER_BATCH_SIZE = 4
+
+# Number of seconds a queue length may be served from the cache before it is
+# counted again
+QUEUE_LENGTH_CACHE_TIMEOUT = 5